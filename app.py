@@ -1,11 +1,11 @@
 import streamlit as st
-import requests
-from bs4 import BeautifulSoup
 import google.generativeai as genai
-from googleapiclient.discovery import build
-import json
 import os
 
+import pipeline
+from cache import ByteBudgetCache
+from draft_cache import SimilarDraftCache
+
 # --- 0. Page Configuration ---
 # *** הוספתי אייקון של עט ***
 st.set_page_config(layout="wide", page_title="AI Perfume Description Generator", page_icon="🖋️")
@@ -194,165 +194,46 @@ except Exception as e:
 
 # --- 2. Helper Functions ---
 
-@st.cache_data(ttl=3600)
+@st.cache_resource
+def get_response_cache():
+    """
+    Shared compressed cache for search results, scraped pages and Gemini extraction/SEO outputs.
+    One instance per server process, bounded by CACHE_MAX_MB (default 64).
+    """
+    max_mb = float(st.secrets.get("CACHE_MAX_MB", 64))
+    codec = st.secrets.get("CACHE_CODEC", "zlib")
+    return ByteBudgetCache(max_bytes=int(max_mb * 1024 * 1024), codec=codec)
+
+@st.cache_resource
+def get_draft_cache():
+    """
+    Shared near-duplicate cache for step-B drafts (opt-in from the UI).
+    """
+    return SimilarDraftCache(threshold=float(st.secrets.get("DRAFT_REUSE_THRESHOLD", 0.8)))
+
 def search_google_for_url(brand, model, sites, debug_mode=False):
     """
     Searches Google Custom Search for the product URL on trusted sites.
-    Tries multiple search strategies for better results.
     """
-    try:
-        service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY)
-        
-        # Strategy 1: Flexible search without quotes
-        site_query = " OR ".join([f"site:{site}" for site in sites])
-        query1 = f'{brand} {model} ({site_query})'
-        
-        if debug_mode:
-            st.info(f"🔍 ניסיון 1: {query1}")
-        
-        res1 = service.cse().list(q=query1, cx=SEARCH_ENGINE_ID, num=5).execute()
-        
-        # Check results from strategy 1
-        if 'items' in res1 and len(res1['items']) > 0:
-            for item in res1['items']:
-                title_lower = item.get('title', '').lower()
-                snippet_lower = item.get('snippet', '').lower()
-                url_lower = item.get('link', '').lower()
-                combined = f"{title_lower} {snippet_lower} {url_lower}"
-                
-                # Verify both brand and model appear
-                if brand.lower() in combined and model.lower() in combined:
-                    if debug_mode:
-                        st.success(f"✅ מצאתי התאמה: {item['title']}")
-                    return item['link'], item['snippet'], query1
-                
-            # Return first result if no perfect match
-            if debug_mode:
-                st.warning("⚠️ לא נמצאה התאמה מושלמת, מחזיר תוצאה ראשונה")
-            return res1['items'][0]['link'], res1['items'][0]['snippet'], query1
-        
-        # Strategy 2: Try with exact phrase for model
-        query2 = f'{brand} "{model}" ({site_query})'
-        if debug_mode:
-            st.info(f"🔍 ניסיון 2: {query2}")
-        
-        res2 = service.cse().list(q=query2, cx=SEARCH_ENGINE_ID, num=5).execute()
-        
-        if 'items' in res2 and len(res2['items']) > 0:
-            if debug_mode:
-                st.success(f"✅ נמצא בניסיון 2: {res2['items'][0]['title']}")
-            return res2['items'][0]['link'], res2['items'][0]['snippet'], query2
-        
-        # Strategy 3: Try each site individually
-        if debug_mode:
-            st.info("🔍 ניסיון 3: חיפוש לכל אתר בנפרד")
-        
-        for site in sites[:3]:  # Try first 3 sites only
-            query3 = f'{brand} {model} site:{site}'
-            if debug_mode:
-                st.info(f"    - מחפש ב: {site}")
-            
-            res3 = service.cse().list(q=query3, cx=SEARCH_ENGINE_ID, num=3).execute()
-            
-            if 'items' in res3 and len(res3['items']) > 0:
-                if debug_mode:
-                    st.success(f"✅ נמצא ב-{site}: {res3['items'][0]['title']}")
-                return res3['items'][0]['link'], res3['items'][0]['snippet'], query3
-        
-        return None, "No results found after trying multiple strategies.", None
-            
-    except Exception as e:
-        return None, f"Error during Google Search: {e}", None
+    return pipeline.search_google_for_url(
+        brand, model, sites, GOOGLE_API_KEY, SEARCH_ENGINE_ID,
+        debug_mode=debug_mode, cache=get_response_cache(), ui=st
+    )
 
-@st.cache_data(ttl=600)
 def scrape_page_text(url):
     """
     Scrapes all visible text from a given URL.
     """
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script/style tags
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.extract()
-        
-        text = soup.get_text(separator=' ', strip=True)
-        # Limit text size
-        return text[:20000]
-        
-    except Exception as e:
-        st.error(f"Error scraping URL {url}: {e}")
-        return None
+    return pipeline.scrape_page_text(url, cache=get_response_cache(), ui=st)
 
-def call_gemini(prompt_text, use_json_mode=False, model_name='models/gemini-2.5-flash', retry_count=3):
+def call_gemini(prompt_text, use_json_mode=False, model_name=pipeline.DEFAULT_MODEL, retry_count=3):
     """
     Generic function to call the Gemini API with retry logic.
     """
-    import time
-    
-    for attempt in range(retry_count):
-        try:
-            model = genai.GenerativeModel(model_name)
-            generation_config = {}
-            if use_json_mode:
-                generation_config = {"response_mime_type": "application/json"}
-                
-            response = model.generate_content(prompt_text, generation_config=generation_config)
-            return response.text
-            
-        except Exception as e:
-            error_msg = str(e)
-            
-            # Check if it's a quota error
-            if "429" in error_msg or "quota" in error_msg.lower():
-                st.warning(f"⚠️ חריגה ממכסת המודל '{model_name}'")
-                
-                # Try to extract retry delay
-                if "retry in" in error_msg.lower():
-                    import re
-                    match = re.search(r'retry in ([\d.]+)s', error_msg)
-                    if match:
-                        wait_time = float(match.group(1))
-                        st.info(f"⏳ ממתין {int(wait_time)} שניות לפני ניסיון חוזר...")
-                        time.sleep(wait_time)
-                        continue
-                
-                # If this is not the last attempt, try with flash model
-                if attempt < retry_count - 1 and 'pro' in model_name:
-                    st.info("🔄 מנסה עם מודל Flash (זול יותר)...")
-                    model_name = 'models/gemini-2.5-flash'
-                    time.sleep(2)
-                    continue
-                else:
-                    st.error(f"""
-                    ❌ **מכסת ה-API מלאה!**
-                    
-                    פתרונות אפשריים:
-                    1. המתן כ-60 שניות ונסה שוב (המכסה מתאפסת כל דקה)
-                    2. השתמש במודל `gemini-2.5-flash` במקום `pro` (יש לו מכסה גבוהה יותר)
-                    3. שדרג לתוכנית בתשלום: [Google AI Studio](https://ai.google.dev/pricing)
-                    4. בדוק את השימוש שלך: [Usage Dashboard](https://ai.dev/usage?tab=rate-limit)
-                    
-                    **הסבר:** אתה ב-2/2 RPM על gemini-2.5-pro - המכסה מלאה! 
-                    """)
-                    return None
-            
-            # Other errors
-            elif attempt < retry_count - 1:
-                st.warning(f"⚠️ ניסיון {attempt + 1} נכשל, מנסה שוב...")
-                time.sleep(2)
-            else:
-                st.error(f"❌ Gemini API Error: {error_msg}")
-                st.info(f"💡 המודל '{model_name}' לא זמין. נסה לבחור מודל אחר")
-                return None
-    
-    return None
+    return pipeline.call_gemini(
+        prompt_text, use_json_mode=use_json_mode, model_name=model_name,
+        retry_count=retry_count, cache=get_response_cache(), ui=st
+    )
 
 # --- 3. Streamlit UI Layout ---
 
@@ -380,33 +261,33 @@ with col2:
     model_input = st.text_input("שם הדגם", placeholder="לדוגמה: Naxos")
 
 # Site options
-site_options = [
-    "nicheperfumes.net",
-    "jovoyparis.com",
-    "nadiaperfumeria.com",
-    "selfridges.com",
-    "luckyscent.com",
-    "lamaisonduparfum.com",
-    "fragrancesandart.com",
-    "neroli.hu",
-    "ecuacionnatural.com",
-    "profumiluxurybrands.it",
-    "maxaroma.com",
-    "essenza-nobile.de",
-    "ausliebezumduft.de",
-    "fragrantica.com",
-    "basenotes.net"
-]
+site_options = pipeline.SITE_OPTIONS
 
 sites_to_search = st.multiselect(
     "אתרים אמינים לחיפוש",
     options=site_options,
-    default=["jovoyparis.com", "essenza-nobile.de", "nicheperfumes.net", "luckyscent.com", "fragrantica.com"]
+    default=pipeline.DEFAULT_SITES
 )
 
 # Debug mode toggle
 debug_mode = st.checkbox("🔧 מצב דיבאג (הצג פרטי חיפוש)", value=False)
 
+if debug_mode:
+    cache_stats = get_response_cache().stats()
+    with st.sidebar.expander("📦 סטטיסטיקות מטמון", expanded=False):
+        st.markdown(
+            f"- רשומות: {cache_stats['entries']:,}\n"
+            f"- זיכרון: {cache_stats['bytes'] / 1024:,.1f} / {cache_stats['max_bytes'] / 1024:,.0f} KB\n"
+            f"- יחס דחיסה ({cache_stats['codec']}): {cache_stats['compression_ratio']:.2f}x\n"
+            f"- פגיעות / החטאות: {cache_stats['hits']:,} / {cache_stats['misses']:,}\n"
+            f"- פינויים: {cache_stats['evictions']:,}"
+        )
+        draft_stats = get_draft_cache().stats()
+        st.caption(
+            f"טיוטות דומות: {draft_stats['entries']:,} רשומות | "
+            f"שימוש חוזר: {draft_stats['hits']:,} | ללא התאמה: {draft_stats['misses']:,}"
+        )
+
 # Clean sites list (fix for RTL bug)
 cleaned_sites = []
 for site in sites_to_search:
@@ -473,6 +354,12 @@ with col_model:
     )
 # --- *** סוף שורה חדשה *** ---
 
+reuse_similar_drafts = st.checkbox(
+    "♻️ שימוש חוזר בטיוטות של בשמים דומים",
+    value=False,
+    help="כאשר פירמידת התווים כמעט זהה (למשל EDP מול Extrait) והגדרות הכתיבה זהות, נעשה שימוש בטיוטה קיימת במקום קריאת AI נוספת"
+)
+
 
 # Add back 'models/' prefix if needed
 if not gemini_model.startswith('models/'):
@@ -536,27 +423,7 @@ if st.session_state.found_url and st.session_state.scraped_text:
         
         # Step 1: Extract Data
         with st.spinner("שלב א': מחלץ תווים מהעמוד... ⏳"):
-            prompt_extract = f"""
-You are a data extraction bot. Your task is to parse the following raw text from a perfume website.
-Extract ONLY the following information in a clean JSON format.
-If you can't find information, return null for that field. Do not add any commentary.
-Respond *only* with valid JSON.
-
-JSON Structure:
-{{
-  "perfume_name": "...",
-  "brand_name": "...",
-  "top_notes": ["...", "..."],
-  "heart_notes": ["...", "..."],
-  "base_notes": ["...", "..."],
-  "perfumer": "...",
-  "year": "...",
-  "concentration": "..."
-}}
-
-RAW TEXT:
-{st.session_state.scraped_text}
-"""
+            prompt_extract = pipeline.build_extract_prompt(st.session_state.scraped_text)
             
             extracted_json_str = call_gemini(prompt_extract, use_json_mode=True, model_name=gemini_model_full)
             
@@ -565,8 +432,7 @@ RAW TEXT:
                 st.stop()
                 
             try:
-                extracted_json_str = extracted_json_str.replace("```json", "").replace("```", "").strip()
-                st.session_state.extracted_data = json.loads(extracted_json_str)
+                st.session_state.extracted_data = pipeline.parse_extracted_json(extracted_json_str)
                 
                 with st.expander("תווים שחולצו (לחץ להצגה) 📋", expanded=False):
                     st.json(st.session_state.extracted_data)
@@ -581,74 +447,23 @@ RAW TEXT:
         with st.spinner("שלב ב': כותב תיאור יצירתי... ⏳"):
             extracted_data = st.session_state.extracted_data
             
-            # Build notes description
-            notes_desc = ""
-            if extracted_data.get('top_notes'):
-                notes_desc += f"תווים עליונים: {', '.join(extracted_data['top_notes'])}\n"
-            if extracted_data.get('heart_notes'):
-                notes_desc += f"תווים אמצעיים: {', '.join(extracted_data['heart_notes'])}\n"
-            if extracted_data.get('base_notes'):
-                notes_desc += f"תווים בסיסיים: {', '.join(extracted_data['base_notes'])}"
-            
-            # --- עדכון הפרומפט עם הסליידר ---
-            prompt_write = f"""
-אתה קופירייטר מומחה לבשמי נישה עבור בוטיק יוקרתי.
-הטון שלך מתוחכם, מעורר חושים ומסתורי.
-
-משימה: כתוב תיאור מוצר שיווקי ומרגש באורך של כ-{length_slider} מילים.
-אל תציין רק את התווים, אלא תשזור אותם בתוך סיפור או חוויה חושית.
-חשוב: אל תשתמש בכוכביות (**) או הדגשות אחרות במקטע. כתוב טקסט רגיל בלבד.
-
-נתונים:
-- שם: {extracted_data.get('perfume_name') or model_input}
-- מותג: {extracted_data.get('brand_name') or brand_input}
-{notes_desc}
-- קהל יעד: {audience_input}
-- אווירה רצויה: {vibe_input}
-
-כתוב בעברית. התחל עם כותרת מרתקת (לא כותרת H1, רק משפט פותח).
-התמקד בחוויה ובתחושות, לא בפירוט טכני יבש.
-"""
-            # --- סוף עדכון הפרומפט ---
-            
-            creative_draft = call_gemini(prompt_write, model_name=gemini_model_full)
-            if not creative_draft:
+            try:
+                creative_draft = pipeline.write_draft(
+                    extracted_data, brand_input, model_input, vibe_input, audience_input, length_slider,
+                    model_name=gemini_model_full,
+                    draft_cache=get_draft_cache() if reuse_similar_drafts else None,
+                    ui=st
+                )
+            except pipeline.PipelineError:
                 st.error("שלב ב' נכשל: Gemini לא החזיר טיוטה. ❌")
                 st.stop()
             
-            # Remove any bold/emphasis markers from the response
-            creative_draft = creative_draft.replace("**", "").replace("__", "")
-            
             with st.expander("טיוטה יצירתית (לחץ להצגה) 📝", expanded=True):
                 st.markdown(creative_draft)
 
         # Step 3: SEO Optimization
         with st.spinner("שלב ג': מבצע אופטימיזציית SEO... ⏳"):
-            prompt_seo = f"""
-אתה מומחה SEO לאתרי איקומרס בתחום הבישום.
-
-משימה:
-1. נתח את תיאור המוצר הבא מבחינת SEO
-2. ספק 3-5 נקודות לשיפור (צפיפות מילות מפתח, קריאות, ייחודיות)
-3. כתוב את הגרסה הסופית המשופרת בעברית
-
-חשוב מאוד: אל תשתמש בכוכביות (**) או הדגשות כלשהן בטקסט הסופי!
-
-מילות מפתח חובה לשילוב: '{model_input}', '{brand_input}', 'בושם יוקרה', 'בושם נישה', {seo_keywords_input}.
-
-טיוטה לניתוח:
-{creative_draft}
-
-החזר בפורמט הבא (בדיוק כך):
-
-## ניתוח SEO
-- נקודה 1
-- נקודה 2
-- נקודה 3
-
-## גרסה סופית משופרת
-[הטקסט המוכן ללא כוכביות או הדגשות]
-"""
+            prompt_seo = pipeline.build_seo_prompt(creative_draft, brand_input, model_input, seo_keywords_input)
             
             final_output = call_gemini(prompt_seo, model_name=gemini_model_full)
             if not final_output:
@@ -656,25 +471,15 @@ RAW TEXT:
                 st.stop()
 
             # Remove bold markers
-            final_output = final_output.replace("**", "").replace("__", "")
+            final_output = pipeline.strip_emphasis(final_output)
 
             st.markdown("---")
             st.subheader("תוצר סופי: ניתוח SEO ותיאור מוכן ✅")
             
             # Parse and format the output with styled boxes
-            sections = final_output.split("##")
-            
-            for section in sections:
-                section = section.strip()
-                if not section:
-                    continue
-                    
-                if "ניתוח seo" in section.lower():
+            for kind, title, content in pipeline.split_seo_sections(final_output):
+                if kind == "analysis":
                     # SEO Analysis section
-                    lines = section.split('\n')
-                    title = lines[0].strip()
-                    content = '\n'.join(lines[1:]).strip()
-                    
                     st.markdown(f"""
                     <div class="seo-section">
                         <h3>{title}</h3>
@@ -684,12 +489,8 @@ RAW TEXT:
                     </div>
                     """, unsafe_allow_html=True)
                     
-                elif "גרסה סופית" in section.lower() or "הטקסט המוכן" in section.lower():
+                else:
                     # Final version section
-                    lines = section.split('\n')
-                    title = lines[0].strip()
-                    content = '\n'.join(lines[1:]).strip().replace("[הטקסט המוכן ללא כוכביות או הדגשות]", "")
-                    
                     st.markdown(f"""
                     <div class="final-version-box">
                         <h3>{title}</h3>
@@ -0,0 +1,100 @@
+import argparse
+import random
+import statistics
+import time
+
+from draft_cache import SimilarDraftCache, jaccard, notes_tokens
+
+# --- Benchmark: near-duplicate draft lookup cost at catalog scale ---
+# Builds a synthetic catalog of notes pyramids, indexes it in SimilarDraftCache and
+# times lookups for flanker-style near duplicates and unrelated scents, compared with
+# a brute-force Jaccard scan over the same catalog.
+
+SETTINGS = ("ערב ומסתורי", "יוניסקס", 150, "models/gemini-2.5-flash")
+
+
+def random_pyramid(rng, vocabulary):
+    notes = rng.sample(vocabulary, rng.randint(9, 15))
+    return {
+        "top_notes": notes[:3],
+        "heart_notes": notes[3:6],
+        "base_notes": notes[6:],
+    }
+
+
+def flanker_of(rng, pyramid, vocabulary):
+    """
+    Returns a copy of pyramid with one note swapped, like an EDP vs Extrait page.
+    """
+    flanker = {tier: list(notes) for tier, notes in pyramid.items()}
+    tier = rng.choice(list(flanker))
+    flanker[tier][rng.randrange(len(flanker[tier]))] = rng.choice(vocabulary)
+    return flanker
+
+
+def time_calls(func, items):
+    timings = []
+    results = []
+    for item in items:
+        start = time.perf_counter()
+        results.append(func(item))
+        timings.append(time.perf_counter() - start)
+    return timings, results
+
+
+def describe(label, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"  {label:<24} mean {statistics.mean(timings) * 1e6:9.1f} us   "
+          f"p50 {statistics.median(timings) * 1e6:9.1f} us   p99 {p99 * 1e6:9.1f} us")
+
+
+def run(catalog_size, queries, threshold, seed):
+    rng = random.Random(seed)
+    vocabulary = [f"note {i}" for i in range(400)]
+    catalog = [random_pyramid(rng, vocabulary) for _ in range(catalog_size)]
+
+    cache = SimilarDraftCache(threshold=threshold, max_entries=catalog_size)
+    start = time.perf_counter()
+    for i, pyramid in enumerate(catalog):
+        cache.add(pyramid, SETTINGS, f"Perfume {i} by Brand: a draft", f"Perfume {i}", "Brand")
+    build_seconds = time.perf_counter() - start
+
+    near = [flanker_of(rng, rng.choice(catalog), vocabulary) for _ in range(queries)]
+    unrelated = [random_pyramid(rng, vocabulary) for _ in range(queries)]
+
+    catalog_tokens = [notes_tokens(pyramid) for pyramid in catalog]
+
+    def brute_force(pyramid):
+        tokens = notes_tokens(pyramid)
+        return max(jaccard(tokens, other) for other in catalog_tokens)
+
+    near_timings, near_results = time_calls(lambda p: cache.lookup(p, SETTINGS, "Flanker", "Brand"), near)
+    unrelated_timings, _ = time_calls(lambda p: cache.lookup(p, SETTINGS, "Flanker", "Brand"), unrelated)
+    brute_timings, brute_scores = time_calls(brute_force, near)
+
+    expected_hits = sum(score >= threshold for score in brute_scores)
+    found_hits = sum(result is not None for result in near_results)
+
+    print(f"catalog={catalog_size:,} queries={queries:,} threshold={threshold}")
+    print(f"  index build              {build_seconds:.2f} s ({build_seconds / catalog_size * 1e6:.1f} us/entry)")
+    describe("lookup (near duplicate)", near_timings)
+    describe("lookup (unrelated)", unrelated_timings)
+    describe("brute-force scan", brute_timings)
+    print(f"  recall vs brute force    {found_hits}/{expected_hits}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SimilarDraftCache lookups at catalog scale.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.queries, args.threshold, args.seed)
+
+
+if __name__ == "__main__":
+    main()
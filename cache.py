@@ -0,0 +1,158 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# --- Optional zstd support ---
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("zlib", "zstd")
+
+
+class ByteBudgetCache:
+    """
+    Thread-safe in-process LRU cache with a hard byte budget.
+    Values are pickled and compressed; eviction is by stored size (compressed value
+    plus pickled key), not entry count.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, codec="zlib", level=6):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of {CODECS}")
+        if codec == "zstd" and zstandard is None:
+            raise ImportError("codec 'zstd' requires the 'zstandard' package")
+
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.level = level
+        self._entries = OrderedDict()  # key -> (blob, stored_size, raw_size, expires_at)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._raw_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rejected = 0
+
+        if codec == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    def _compress(self, raw):
+        if self.codec == "zstd":
+            return self._compressor.compress(raw)
+        return zlib.compress(raw, self.level)
+
+    def _decompress(self, blob):
+        if self.codec == "zstd":
+            return self._decompressor.decompress(blob)
+        return zlib.decompress(blob)
+
+    def _drop(self, key):
+        _, stored_size, raw_size, _ = self._entries.pop(key)
+        self._bytes -= stored_size
+        self._raw_bytes -= raw_size
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            blob, _, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._drop(key)
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+        # Decompress outside the lock so readers don't serialize on CPU work
+        return pickle.loads(self._decompress(blob))
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores value under key, evicting least-recently-used entries to stay within budget.
+        Keys count against the budget too, so callers should keep them short (e.g. digests).
+        Returns False if the entry alone exceeds the budget.
+        """
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        blob = self._compress(raw)
+        key_size = len(pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL))
+        stored_size = len(blob) + key_size
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if stored_size > self.max_bytes:
+                self._rejected += 1
+                return False
+            while self._bytes + stored_size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evictions += 1
+            self._entries[key] = (blob, stored_size, len(raw) + key_size, expires_at)
+            self._bytes += stored_size
+            self._raw_bytes += len(raw) + key_size
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._raw_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        """
+        Returns a snapshot of cache usage counters.
+        """
+        with self._lock:
+            return {
+                "codec": self.codec,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "raw_bytes": self._raw_bytes,
+                "max_bytes": self.max_bytes,
+                "compression_ratio": (self._raw_bytes / self._bytes) if self._bytes else 0.0,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "rejected": self._rejected,
+            }
+
+
+def cached_call(cache, key, compute, ttl=None, should_cache=lambda value: value is not None):
+    """
+    Returns cache[key] if present, otherwise computes, stores and returns the value.
+    Results rejected by should_cache (by default None) are returned but not stored.
+    """
+    if cache is None:
+        return compute()
+    sentinel = object()
+    value = cache.get(key, sentinel)
+    if value is not sentinel:
+        return value
+    value = compute()
+    if should_cache(value):
+        cache.set(key, value, ttl=ttl)
+    return value
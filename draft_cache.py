@@ -0,0 +1,191 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+
+# --- Near-duplicate cache for step-B creative drafts ---
+# Flankers and concentrations of the same scent extract to nearly identical notes
+# pyramids. Drafts are indexed by a MinHash signature of the normalized notes and
+# bucketed with LSH banding, so a lookup only compares against a handful of
+# candidates instead of the whole catalog. Settings (vibe/audience/length) must match exactly.
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+NOTE_TIERS = ("top_notes", "heart_notes", "base_notes")
+
+
+def normalize_note(note):
+    """
+    Lowercases a note and strips punctuation and extra whitespace.
+    """
+    note = re.sub(r"[^\w\s]", " ", str(note).lower())
+    return " ".join(note.split())
+
+
+def notes_tokens(extracted_data):
+    """
+    Returns the normalized notes pyramid as a frozenset of "tier:note" tokens.
+    A tier given as a string (e.g. "bergamot, lemon") is split on commas; any other
+    non-list value is treated as having no notes.
+    """
+    tokens = set()
+    for tier in NOTE_TIERS:
+        notes = extracted_data.get(tier)
+        if isinstance(notes, str):
+            notes = notes.split(",")
+        elif not isinstance(notes, (list, tuple)):
+            continue
+        for note in notes:
+            note = normalize_note(note)
+            if note:
+                tokens.add(f"{tier}:{note}")
+    return frozenset(tokens)
+
+
+def jaccard(a, b):
+    """
+    Returns the Jaccard similarity of two token sets.
+    """
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """
+    MinHash signatures over string tokens using seeded universal hash permutations.
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, tokens):
+        hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big") for t in tokens]
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+
+class SimilarDraftCache:
+    """
+    Bounded LRU store of creative drafts with MinHash/LSH lookup by notes similarity.
+    A hit requires exact settings, an exact Jaccard similarity >= threshold, and a draft
+    that adapt_draft can safely rename for the requested perfume and brand.
+    """
+
+    def __init__(self, threshold=0.8, max_entries=5000, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._hasher = MinHasher(num_perm)
+        self._entries = OrderedDict()  # entry_id -> (settings, tokens, band_keys, draft, name, brand)
+        self._buckets = {}  # (settings, band_index, band) -> set of entry_ids
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _band_keys(self, settings, tokens):
+        signature = self._hasher.signature(tokens)
+        return [
+            (settings, i, signature[i * self.rows:(i + 1) * self.rows])
+            for i in range(self.bands)
+        ]
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for key in entry[2]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def lookup(self, extracted_data, settings, name, brand):
+        """
+        Returns (adapted_draft, cached_name, similarity) for the most similar cached draft, or None.
+        """
+        tokens = notes_tokens(extracted_data)
+        if not tokens:
+            with self._lock:
+                self._misses += 1
+            return None
+        band_keys = self._band_keys(settings, tokens)
+
+        with self._lock:
+            candidates = set()
+            for key in band_keys:
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                score = jaccard(tokens, self._entries[entry_id][1])
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < self.threshold:
+                self._misses += 1
+                return None
+            _, _, _, draft, cached_name, cached_brand = self._entries[best_id]
+            adapted = adapt_draft(draft, cached_name, cached_brand, name, brand)
+            if adapted is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._hits += 1
+            return adapted, cached_name, best_score
+
+    def add(self, extracted_data, settings, draft, name, brand):
+        """
+        Indexes a draft under its notes and settings, evicting the least recently used entry if full.
+        """
+        tokens = notes_tokens(extracted_data)
+        if not tokens:
+            return
+        band_keys = self._band_keys(settings, tokens)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (settings, tokens, band_keys, draft, name, brand)
+            for key in band_keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+def adapt_draft(draft, cached_name, cached_brand, name, brand):
+    """
+    Lightly adapts a reused draft by swapping the cached perfume and brand names for the new ones.
+    Returns None when a name differs but the cached one does not appear verbatim in the draft
+    (e.g. Gemini transliterated it), since the reused text would describe the wrong product.
+    """
+    for cached, new in ((cached_name, name), (cached_brand, brand)):
+        if cached == new:
+            continue
+        if not cached or not new or cached not in draft:
+            return None
+        draft = draft.replace(cached, new)
+    return draft
@@ -0,0 +1,533 @@
+import hashlib
+import ipaddress
+import json
+import logging
+import re
+import socket
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+import google.generativeai as genai
+from googleapiclient.discovery import build
+
+from cache import cached_call
+
+# --- Shared perfume pipeline: search, scrape, extract, generate ---
+# Used by both the Streamlit page (app.py) and the headless service (service.py).
+# Functions that report progress take a `ui` object exposing info/success/warning/error;
+# app.py passes the `st` module, the service uses LOG_UI which writes to the logger.
+
+logger = logging.getLogger("perfume_generator")
+
+DEFAULT_MODEL = 'models/gemini-2.5-flash'
+
+SITE_OPTIONS = [
+    "nicheperfumes.net",
+    "jovoyparis.com",
+    "nadiaperfumeria.com",
+    "selfridges.com",
+    "luckyscent.com",
+    "lamaisonduparfum.com",
+    "fragrancesandart.com",
+    "neroli.hu",
+    "ecuacionnatural.com",
+    "profumiluxurybrands.it",
+    "maxaroma.com",
+    "essenza-nobile.de",
+    "ausliebezumduft.de",
+    "fragrantica.com",
+    "basenotes.net"
+]
+DEFAULT_SITES = ["jovoyparis.com", "essenza-nobile.de", "nicheperfumes.net", "luckyscent.com", "fragrantica.com"]
+DEFAULT_VIBE = "ערב ומסתורי"
+DEFAULT_AUDIENCE = "יוניסקס"
+DEFAULT_LENGTH = 150
+
+
+class PipelineError(Exception):
+    """
+    Raised when a pipeline step cannot produce a usable result.
+    """
+
+
+class LogUI:
+    """
+    Minimal stand-in for the Streamlit message API that writes to the logger.
+    """
+
+    def info(self, msg):
+        logger.info(msg)
+
+    def success(self, msg):
+        logger.info(msg)
+
+    def warning(self, msg):
+        logger.warning(msg)
+
+    def error(self, msg):
+        logger.error(msg)
+
+
+LOG_UI = LogUI()
+
+# --- 1. External calls (cached when a cache is passed) ---
+
+def search_google_for_url(brand, model, sites, api_key, engine_id, debug_mode=False, cache=None, ui=None):
+    """
+    Cached wrapper around _search_google_for_url. Only successful lookups are cached.
+    """
+    return cached_call(
+        cache,
+        ("search", brand, model, tuple(sites)),
+        lambda: _search_google_for_url(brand, model, sites, api_key, engine_id, debug_mode=debug_mode, ui=ui),
+        ttl=3600,
+        should_cache=lambda result: result[0] is not None
+    )
+
+def _search_google_for_url(brand, model, sites, api_key, engine_id, debug_mode=False, ui=None):
+    """
+    Searches Google Custom Search for the product URL on trusted sites.
+    Tries multiple search strategies for better results.
+    """
+    ui = ui or LOG_UI
+    try:
+        service = build("customsearch", "v1", developerKey=api_key)
+        
+        # Strategy 1: Flexible search without quotes
+        site_query = " OR ".join([f"site:{site}" for site in sites])
+        query1 = f'{brand} {model} ({site_query})'
+        
+        if debug_mode:
+            ui.info(f"🔍 ניסיון 1: {query1}")
+        
+        res1 = service.cse().list(q=query1, cx=engine_id, num=5).execute()
+        
+        # Check results from strategy 1
+        if 'items' in res1 and len(res1['items']) > 0:
+            for item in res1['items']:
+                title_lower = item.get('title', '').lower()
+                snippet_lower = item.get('snippet', '').lower()
+                url_lower = item.get('link', '').lower()
+                combined = f"{title_lower} {snippet_lower} {url_lower}"
+                
+                # Verify both brand and model appear
+                if brand.lower() in combined and model.lower() in combined:
+                    if debug_mode:
+                        ui.success(f"✅ מצאתי התאמה: {item['title']}")
+                    return item['link'], item['snippet'], query1
+                
+            # Return first result if no perfect match
+            if debug_mode:
+                ui.warning("⚠️ לא נמצאה התאמה מושלמת, מחזיר תוצאה ראשונה")
+            return res1['items'][0]['link'], res1['items'][0]['snippet'], query1
+        
+        # Strategy 2: Try with exact phrase for model
+        query2 = f'{brand} "{model}" ({site_query})'
+        if debug_mode:
+            ui.info(f"🔍 ניסיון 2: {query2}")
+        
+        res2 = service.cse().list(q=query2, cx=engine_id, num=5).execute()
+        
+        if 'items' in res2 and len(res2['items']) > 0:
+            if debug_mode:
+                ui.success(f"✅ נמצא בניסיון 2: {res2['items'][0]['title']}")
+            return res2['items'][0]['link'], res2['items'][0]['snippet'], query2
+        
+        # Strategy 3: Try each site individually
+        if debug_mode:
+            ui.info("🔍 ניסיון 3: חיפוש לכל אתר בנפרד")
+        
+        for site in sites[:3]:  # Try first 3 sites only
+            query3 = f'{brand} {model} site:{site}'
+            if debug_mode:
+                ui.info(f"    - מחפש ב: {site}")
+            
+            res3 = service.cse().list(q=query3, cx=engine_id, num=3).execute()
+            
+            if 'items' in res3 and len(res3['items']) > 0:
+                if debug_mode:
+                    ui.success(f"✅ נמצא ב-{site}: {res3['items'][0]['title']}")
+                return res3['items'][0]['link'], res3['items'][0]['snippet'], query3
+        
+        return None, "No results found after trying multiple strategies.", None
+            
+    except Exception as e:
+        return None, f"Error during Google Search: {e}", None
+
+def url_matches_sites(url, sites):
+    """
+    Returns True if url is http(s) and its host is one of sites or a subdomain of one.
+    """
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower().rstrip(".")
+    if parsed.scheme not in ("http", "https") or not host:
+        return False
+    return any(host == site or host.endswith(f".{site}") for site in sites)
+
+def check_scrape_url(url, allowed_sites):
+    """
+    Raises PipelineError unless url matches allowed_sites and its host resolves
+    only to public addresses (no private, loopback, link-local or reserved ranges).
+    """
+    if not url_matches_sites(url, allowed_sites):
+        raise PipelineError(f"URL is not on an allowed site: {url}")
+    parsed = urlparse(url)
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+    except socket.gaierror as e:
+        raise PipelineError(f"Could not resolve {parsed.hostname}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global:
+            raise PipelineError(f"URL resolves to a non-public address: {url}")
+
+def scrape_page_text(url, cache=None, allowed_sites=None, ui=None):
+    """
+    Cached wrapper around _scrape_page_text. Failed scrapes are not cached.
+    """
+    return cached_call(cache, ("scrape", url), lambda: _scrape_page_text(url, allowed_sites=allowed_sites, ui=ui), ttl=600)
+
+def _scrape_page_text(url, allowed_sites=None, ui=None, max_redirects=5):
+    """
+    Scrapes all visible text from a given URL.
+    With allowed_sites, the URL and every redirect target are checked with check_scrape_url.
+    """
+    ui = ui or LOG_UI
+    try:
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+        if allowed_sites is None:
+            response = requests.get(url, headers=headers, timeout=10)
+        else:
+            target = url
+            for _ in range(max_redirects + 1):
+                check_scrape_url(target, allowed_sites)
+                response = requests.get(target, headers=headers, timeout=10, allow_redirects=False)
+                if not response.is_redirect:
+                    break
+                target = urljoin(target, response.headers["Location"])
+            else:
+                raise PipelineError(f"Too many redirects for {url}")
+        response.raise_for_status()
+        
+        soup = BeautifulSoup(response.text, 'html.parser')
+        
+        # Remove script/style tags
+        for script in soup(["script", "style", "nav", "footer", "header"]):
+            script.extract()
+        
+        text = soup.get_text(separator=' ', strip=True)
+        # Limit text size
+        return text[:20000]
+        
+    except Exception as e:
+        ui.error(f"Error scraping URL {url}: {e}")
+        return None
+
+def call_gemini(prompt_text, use_json_mode=False, model_name=DEFAULT_MODEL, retry_count=3, cache=None, ui=None):
+    """
+    Cached wrapper around _call_gemini, keyed on a digest of the exact prompt and model.
+    In JSON mode only responses that parse are cached, so a retry can recover from bad output.
+    """
+    return cached_call(
+        cache,
+        ("gemini", model_name, use_json_mode, hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()),
+        lambda: _call_gemini(prompt_text, use_json_mode=use_json_mode, model_name=model_name, retry_count=retry_count, ui=ui),
+        ttl=3600,
+        should_cache=_is_valid_json if use_json_mode else (lambda text: text is not None)
+    )
+
+def _is_valid_json(text):
+    if text is None:
+        return False
+    try:
+        parse_extracted_json(text)
+    except ValueError:
+        return False
+    return True
+
+def _call_gemini(prompt_text, use_json_mode=False, model_name=DEFAULT_MODEL, retry_count=3, ui=None):
+    """
+    Generic function to call the Gemini API with retry logic.
+    """
+    ui = ui or LOG_UI
+    
+    for attempt in range(retry_count):
+        try:
+            model = genai.GenerativeModel(model_name)
+            generation_config = {}
+            if use_json_mode:
+                generation_config = {"response_mime_type": "application/json"}
+                
+            response = model.generate_content(prompt_text, generation_config=generation_config)
+            return response.text
+            
+        except Exception as e:
+            error_msg = str(e)
+            
+            # Check if it's a quota error
+            if "429" in error_msg or "quota" in error_msg.lower():
+                ui.warning(f"⚠️ חריגה ממכסת המודל '{model_name}'")
+                
+                # Try to extract retry delay
+                if "retry in" in error_msg.lower():
+                    match = re.search(r'retry in ([\d.]+)s', error_msg)
+                    if match:
+                        wait_time = float(match.group(1))
+                        ui.info(f"⏳ ממתין {int(wait_time)} שניות לפני ניסיון חוזר...")
+                        time.sleep(wait_time)
+                        continue
+                
+                # If this is not the last attempt, try with flash model
+                if attempt < retry_count - 1 and 'pro' in model_name:
+                    ui.info("🔄 מנסה עם מודל Flash (זול יותר)...")
+                    model_name = DEFAULT_MODEL
+                    time.sleep(2)
+                    continue
+                else:
+                    ui.error(f"""
+                    ❌ **מכסת ה-API מלאה!**
+                    
+                    פתרונות אפשריים:
+                    1. המתן כ-60 שניות ונסה שוב (המכסה מתאפסת כל דקה)
+                    2. השתמש במודל `gemini-2.5-flash` במקום `pro` (יש לו מכסה גבוהה יותר)
+                    3. שדרג לתוכנית בתשלום: [Google AI Studio](https://ai.google.dev/pricing)
+                    4. בדוק את השימוש שלך: [Usage Dashboard](https://ai.dev/usage?tab=rate-limit)
+                    
+                    **הסבר:** אתה ב-2/2 RPM על gemini-2.5-pro - המכסה מלאה! 
+                    """)
+                    return None
+            
+            # Other errors
+            elif attempt < retry_count - 1:
+                ui.warning(f"⚠️ ניסיון {attempt + 1} נכשל, מנסה שוב...")
+                time.sleep(2)
+            else:
+                ui.error(f"❌ Gemini API Error: {error_msg}")
+                ui.info(f"💡 המודל '{model_name}' לא זמין. נסה לבחור מודל אחר")
+                return None
+    
+    return None
+
+# --- 2. Prompt builders and response parsing ---
+
+def build_extract_prompt(scraped_text):
+    """
+    Builds the step-A prompt that extracts the notes pyramid as JSON.
+    """
+    return f"""
+You are a data extraction bot. Your task is to parse the following raw text from a perfume website.
+Extract ONLY the following information in a clean JSON format.
+If you can't find information, return null for that field. Do not add any commentary.
+Respond *only* with valid JSON.
+
+JSON Structure:
+{{
+  "perfume_name": "...",
+  "brand_name": "...",
+  "top_notes": ["...", "..."],
+  "heart_notes": ["...", "..."],
+  "base_notes": ["...", "..."],
+  "perfumer": "...",
+  "year": "...",
+  "concentration": "..."
+}}
+
+RAW TEXT:
+{scraped_text}
+"""
+
+def parse_extracted_json(extracted_json_str):
+    """
+    Strips markdown fences from the step-A response and parses it.
+    Raises ValueError (json.JSONDecodeError) on invalid JSON.
+    """
+    extracted_json_str = extracted_json_str.replace("```json", "").replace("```", "").strip()
+    return json.loads(extracted_json_str)
+
+def build_notes_description(extracted_data):
+    """
+    Formats the notes pyramid as Hebrew lines for the creative prompt.
+    """
+    notes_desc = ""
+    if extracted_data.get('top_notes'):
+        notes_desc += f"תווים עליונים: {', '.join(extracted_data['top_notes'])}\n"
+    if extracted_data.get('heart_notes'):
+        notes_desc += f"תווים אמצעיים: {', '.join(extracted_data['heart_notes'])}\n"
+    if extracted_data.get('base_notes'):
+        notes_desc += f"תווים בסיסיים: {', '.join(extracted_data['base_notes'])}"
+    return notes_desc
+
+def build_write_prompt(extracted_data, brand, model, vibe, audience, length):
+    """
+    Builds the step-B prompt for the creative draft.
+    """
+    notes_desc = build_notes_description(extracted_data)
+    return f"""
+אתה קופירייטר מומחה לבשמי נישה עבור בוטיק יוקרתי.
+הטון שלך מתוחכם, מעורר חושים ומסתורי.
+
+משימה: כתוב תיאור מוצר שיווקי ומרגש באורך של כ-{length} מילים.
+אל תציין רק את התווים, אלא תשזור אותם בתוך סיפור או חוויה חושית.
+חשוב: אל תשתמש בכוכביות (**) או הדגשות אחרות במקטע. כתוב טקסט רגיל בלבד.
+
+נתונים:
+- שם: {extracted_data.get('perfume_name') or model}
+- מותג: {extracted_data.get('brand_name') or brand}
+{notes_desc}
+- קהל יעד: {audience}
+- אווירה רצויה: {vibe}
+
+כתוב בעברית. התחל עם כותרת מרתקת (לא כותרת H1, רק משפט פותח).
+התמקד בחוויה ובתחושות, לא בפירוט טכני יבש.
+"""
+
+def build_seo_prompt(creative_draft, brand, model, seo_keywords):
+    """
+    Builds the step-C prompt for SEO analysis and the final version.
+    """
+    return f"""
+אתה מומחה SEO לאתרי איקומרס בתחום הבישום.
+
+משימה:
+1. נתח את תיאור המוצר הבא מבחינת SEO
+2. ספק 3-5 נקודות לשיפור (צפיפות מילות מפתח, קריאות, ייחודיות)
+3. כתוב את הגרסה הסופית המשופרת בעברית
+
+חשוב מאוד: אל תשתמש בכוכביות (**) או הדגשות כלשהן בטקסט הסופי!
+
+מילות מפתח חובה לשילוב: '{model}', '{brand}', 'בושם יוקרה', 'בושם נישה', {seo_keywords}.
+
+טיוטה לניתוח:
+{creative_draft}
+
+החזר בפורמט הבא (בדיוק כך):
+
+## ניתוח SEO
+- נקודה 1
+- נקודה 2
+- נקודה 3
+
+## גרסה סופית משופרת
+[הטקסט המוכן ללא כוכביות או הדגשות]
+"""
+
+def strip_emphasis(text):
+    """
+    Removes bold/emphasis markers from a model response.
+    """
+    return text.replace("**", "").replace("__", "")
+
+def split_seo_sections(final_output):
+    """
+    Splits the step-C response into (kind, title, content) tuples,
+    where kind is "analysis" or "final". Unrecognized sections are skipped.
+    """
+    sections = []
+    for section in final_output.split("##"):
+        section = section.strip()
+        if not section:
+            continue
+
+        lines = section.split('\n')
+        title = lines[0].strip()
+        content = '\n'.join(lines[1:]).strip()
+
+        if "ניתוח seo" in section.lower():
+            sections.append(("analysis", title, content))
+        elif "גרסה סופית" in section.lower() or "הטקסט המוכן" in section.lower():
+            content = content.replace("[הטקסט המוכן ללא כוכביות או הדגשות]", "")
+            sections.append(("final", title, content))
+    return sections
+
+# --- 3. Pipeline steps (raise PipelineError on failure) ---
+
+def extract_notes(scraped_text, model_name=DEFAULT_MODEL, cache=None, ui=None):
+    """
+    Step A: extracts the notes pyramid and metadata from scraped page text.
+    """
+    extracted_json_str = call_gemini(build_extract_prompt(scraped_text), use_json_mode=True, model_name=model_name, cache=cache, ui=ui)
+    if not extracted_json_str:
+        raise PipelineError("Extraction failed: Gemini returned no data.")
+    try:
+        return parse_extracted_json(extracted_json_str)
+    except ValueError as e:
+        raise PipelineError(f"Extraction failed: could not parse JSON. {e}")
+
+def write_draft(extracted_data, brand, model, vibe=DEFAULT_VIBE, audience=DEFAULT_AUDIENCE, length=DEFAULT_LENGTH,
+                model_name=DEFAULT_MODEL, draft_cache=None, ui=None):
+    """
+    Step B: writes the creative draft from extracted data and settings.
+    The creative call is never response-cached, so each run produces a fresh draft.
+    With a draft_cache, a near-duplicate notes pyramid reuses an adapted cached draft instead.
+    """
+    name = extracted_data.get('perfume_name') or model
+    brand_name = extracted_data.get('brand_name') or brand
+    settings = (vibe, audience, length, model_name)
+
+    if draft_cache is not None:
+        match = draft_cache.lookup(extracted_data, settings, name, brand_name)
+        if match:
+            adapted_draft, cached_name, similarity = match
+            (ui or LOG_UI).info(f"♻️ נעשה שימוש חוזר בטיוטה של '{cached_name}' (דמיון תווים {similarity:.0%})")
+            return adapted_draft
+
+    prompt_write = build_write_prompt(extracted_data, brand, model, vibe, audience, length)
+    creative_draft = call_gemini(prompt_write, model_name=model_name, ui=ui)
+    if not creative_draft:
+        raise PipelineError("Creative writing failed: Gemini returned no draft.")
+    creative_draft = strip_emphasis(creative_draft)
+
+    if draft_cache is not None:
+        draft_cache.add(extracted_data, settings, creative_draft, name, brand_name)
+    return creative_draft
+
+def optimize_seo(creative_draft, brand, model, seo_keywords="", model_name=DEFAULT_MODEL, cache=None, ui=None):
+    """
+    Step C: returns the SEO analysis and final description for a draft.
+    """
+    final_output = call_gemini(build_seo_prompt(creative_draft, brand, model, seo_keywords), model_name=model_name, cache=cache, ui=ui)
+    if not final_output:
+        raise PipelineError("SEO optimization failed: Gemini returned no analysis.")
+    final_output = strip_emphasis(final_output)
+
+    result = {"raw": final_output, "analysis": None, "final_text": None}
+    for kind, _, content in split_seo_sections(final_output):
+        if kind == "analysis":
+            result["analysis"] = content
+        else:
+            result["final_text"] = content
+    return result
+
+def generate_description(extracted_data, brand, model, vibe=DEFAULT_VIBE, audience=DEFAULT_AUDIENCE, length=DEFAULT_LENGTH,
+                         seo_keywords="", model_name=DEFAULT_MODEL, cache=None, draft_cache=None, ui=None):
+    """
+    Steps B and C: draft plus SEO pass for already-extracted data.
+    """
+    creative_draft = write_draft(extracted_data, brand, model, vibe, audience, length,
+                                 model_name=model_name, draft_cache=draft_cache, ui=ui)
+    seo = optimize_seo(creative_draft, brand, model, seo_keywords, model_name=model_name, cache=cache, ui=ui)
+    return {"creative_draft": creative_draft, **seo}
+
+def run_pipeline(brand, model, sites, api_key, engine_id, vibe=DEFAULT_VIBE, audience=DEFAULT_AUDIENCE,
+                 length=DEFAULT_LENGTH, seo_keywords="", model_name=DEFAULT_MODEL, cache=None, draft_cache=None,
+                 allowed_sites=None, ui=None):
+    """
+    Full flow: search, scrape, extract and generate for a single product.
+    With allowed_sites, the found URL must pass check_scrape_url before it is fetched.
+    """
+    url, snippet, query = search_google_for_url(brand, model, sites, api_key, engine_id, cache=cache, ui=ui)
+    if not url:
+        raise PipelineError(f"No results found for '{brand} {model}': {snippet}")
+
+    scraped_text = scrape_page_text(url, cache=cache, allowed_sites=allowed_sites, ui=ui)
+    if not scraped_text:
+        raise PipelineError(f"Could not scrape {url}")
+
+    extracted_data = extract_notes(scraped_text, model_name=model_name, cache=cache, ui=ui)
+    generated = generate_description(extracted_data, brand, model, vibe, audience, length, seo_keywords,
+                                     model_name=model_name, cache=cache, draft_cache=draft_cache, ui=ui)
+    return {"url": url, "snippet": snippet, "search_query": query, "extracted_data": extracted_data, **generated}
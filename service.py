@@ -0,0 +1,411 @@
+import argparse
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google.generativeai as genai
+
+import pipeline
+from cache import ByteBudgetCache
+from draft_cache import SimilarDraftCache
+
+# --- Headless HTTP service ---
+# Exposes each pipeline step as a POST endpoint that enqueues a job on a bounded
+# worker pool and returns 202 with a job id; results are polled via GET /jobs/<id>.
+# A full queue answers 429. Every request except GET /health must send
+# "Authorization: Bearer <SERVICE_TOKEN>".
+#
+#   POST /search    {"brand", "model", "sites"?}
+#   POST /scrape    {"url"}  (host must be one of the allowed sites)
+#   POST /extract   {"scraped_text"}
+#   POST /generate  {"extracted_data", "brand", "model", "vibe"?, "audience"?, "length"?, "seo_keywords"?}
+#   POST /pipeline  {"brand", "model", "sites"?, "vibe"?, "audience"?, "length"?, "seo_keywords"?}
+#   GET  /jobs/<id>
+#   GET  /stats     (queue and cache statistics)
+#   GET  /health    (unauthenticated liveness probe for load balancers)
+#
+# "reuse_similar_drafts": true on /generate and /pipeline opts into the near-duplicate draft cache.
+#
+# Job state lives in the process that accepted the job. Job ids have the form
+# "<instance id>-<hex>" (SERVICE_INSTANCE_ID, default the hostname), and the 202 response
+# also returns the instance id in its body and the X-Instance-Id header. Behind a load
+# balancer, route GET /jobs/<instance id>-* to that instance (path-prefix rule) or pin
+# polling to it with the header; a job id from another instance gets a 404 naming its owner.
+
+logger = logging.getLogger("perfume_generator.service")
+
+MAX_BODY_BYTES = 1024 * 1024
+MIN_LENGTH, MAX_LENGTH = 25, 1000
+STRING_FIELDS = ("brand", "model", "url", "scraped_text", "vibe", "audience", "seo_keywords", "model_name")
+INSTANCE_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]+")
+
+
+class QueueFull(Exception):
+    """
+    Raised when the job queue has no free slots.
+    """
+
+
+class JobQueue:
+    """
+    Fixed pool of worker threads fed by a bounded queue.
+    Finished jobs are kept for result_ttl seconds, and at most max_jobs jobs are held;
+    beyond that the oldest finished jobs are dropped first.
+    """
+
+    def __init__(self, workers=4, max_queue=32, result_ttl=3600, max_jobs=1000, instance_id="local"):
+        if max_jobs < workers + max_queue:
+            raise ValueError("max_jobs must be at least workers + max_queue")
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.result_ttl = result_ttl
+        self.max_jobs = max_jobs
+        self.workers = workers
+        self.instance_id = instance_id
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, kind, func, payload):
+        """
+        Enqueues func(payload) and returns the new job id. Raises QueueFull when saturated.
+        """
+        job_id = f"{self.instance_id}-{uuid.uuid4().hex}"
+        job = {"id": job_id, "kind": kind, "status": "queued", "result": None, "error": None,
+               "created": time.time(), "finished": None}
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, func, payload))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise QueueFull()
+        self._prune()
+        return job_id
+
+    def owner(self, job_id):
+        """
+        Returns the instance id encoded in job_id.
+        """
+        return job_id.rsplit("-", 1)[0] if "-" in job_id else None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "instance": self.instance_id,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "running": statuses.count("running"),
+            "jobs_held": len(statuses),
+            "max_jobs": self.max_jobs,
+        }
+
+    def _worker(self):
+        while True:
+            job_id, func, payload = self._queue.get()
+            self._update(job_id, status="running")
+            try:
+                result = func(payload)
+                self._update(job_id, status="done", result=result, finished=time.time())
+            except pipeline.PipelineError as e:
+                self._update(job_id, status="failed", error=str(e), finished=time.time())
+            except Exception as e:
+                logger.exception("Job %s crashed", job_id)
+                self._update(job_id, status="failed", error=f"Internal error: {e}", finished=time.time())
+            finally:
+                self._queue.task_done()
+                self._prune()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job["finished"]]
+            expired = [job_id for job_id in finished if self._jobs[job_id]["finished"] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+            # Jobs are held in submission order, so this drops the oldest finished ones first
+            overflow = len(self._jobs) - self.max_jobs
+            for job_id in [job_id for job_id in finished if job_id in self._jobs][:max(overflow, 0)]:
+                del self._jobs[job_id]
+
+
+class PerfumeService:
+    """
+    Binds the shared pipeline functions to API keys, cache and job queue.
+    """
+
+    # endpoint -> required payload fields
+    REQUIRED_FIELDS = {
+        "search": ("brand", "model"),
+        "scrape": ("url",),
+        "extract": ("scraped_text",),
+        "generate": ("extracted_data", "brand", "model"),
+        "pipeline": ("brand", "model"),
+    }
+
+    def __init__(self, api_key, engine_id, cache, jobs, draft_cache=None, allowed_sites=pipeline.SITE_OPTIONS):
+        self.api_key = api_key
+        self.engine_id = engine_id
+        self.cache = cache
+        self.jobs = jobs
+        self.draft_cache = draft_cache
+        self.allowed_sites = list(allowed_sites)
+
+    def validate(self, step, payload):
+        """
+        Raises ValueError if payload is not acceptable for step.
+        """
+        missing = [field for field in self.REQUIRED_FIELDS[step] if not payload.get(field)]
+        if missing:
+            raise ValueError(f"Missing required fields: {', '.join(missing)}")
+
+        for field in STRING_FIELDS:
+            if field in payload and not isinstance(payload[field], str):
+                raise ValueError(f"'{field}' must be a string")
+
+        if "sites" in payload:
+            sites = payload["sites"]
+            if not isinstance(sites, list) or not sites or not all(isinstance(site, str) for site in sites):
+                raise ValueError("'sites' must be a non-empty list of strings")
+            unknown = [site for site in sites if site not in self.allowed_sites]
+            if unknown:
+                raise ValueError(f"Sites not allowed: {', '.join(unknown)}")
+
+        if "length" in payload:
+            length = payload["length"]
+            if type(length) is not int or not MIN_LENGTH <= length <= MAX_LENGTH:
+                raise ValueError(f"'length' must be an integer between {MIN_LENGTH} and {MAX_LENGTH}")
+
+        if "reuse_similar_drafts" in payload and not isinstance(payload["reuse_similar_drafts"], bool):
+            raise ValueError("'reuse_similar_drafts' must be a boolean")
+
+        if step == "scrape" and not pipeline.url_matches_sites(payload["url"], self.allowed_sites):
+            raise ValueError("'url' must be an http(s) URL on one of the allowed sites")
+
+        if step == "generate":
+            extracted_data = payload["extracted_data"]
+            if not isinstance(extracted_data, dict):
+                raise ValueError("'extracted_data' must be an object")
+            for tier in ("top_notes", "heart_notes", "base_notes"):
+                notes = extracted_data.get(tier)
+                if notes is not None and (not isinstance(notes, list) or not all(isinstance(n, str) for n in notes)):
+                    raise ValueError(f"'extracted_data.{tier}' must be a list of strings")
+            for field in ("perfume_name", "brand_name"):
+                if extracted_data.get(field) is not None and not isinstance(extracted_data[field], str):
+                    raise ValueError(f"'extracted_data.{field}' must be a string")
+
+    def submit(self, step, payload):
+        """
+        Validates payload for step and enqueues it. Raises ValueError on bad input.
+        """
+        self.validate(step, payload)
+        return self.jobs.submit(step, getattr(self, f"run_{step}"), payload)
+
+    def _settings(self, payload):
+        return {
+            "vibe": payload.get("vibe") or pipeline.DEFAULT_VIBE,
+            "audience": payload.get("audience") or pipeline.DEFAULT_AUDIENCE,
+            "length": payload.get("length") or pipeline.DEFAULT_LENGTH,
+            "seo_keywords": payload.get("seo_keywords") or "",
+            "model_name": payload.get("model_name") or pipeline.DEFAULT_MODEL,
+            "draft_cache": self.draft_cache if payload.get("reuse_similar_drafts") else None,
+        }
+
+    def run_search(self, payload):
+        sites = payload.get("sites") or pipeline.DEFAULT_SITES
+        url, snippet, query = pipeline.search_google_for_url(
+            payload["brand"], payload["model"], sites, self.api_key, self.engine_id, cache=self.cache
+        )
+        if not url:
+            raise pipeline.PipelineError(snippet)
+        return {"url": url, "snippet": snippet, "search_query": query}
+
+    def run_scrape(self, payload):
+        scraped_text = pipeline.scrape_page_text(payload["url"], cache=self.cache, allowed_sites=self.allowed_sites)
+        if not scraped_text:
+            raise pipeline.PipelineError(f"Could not scrape {payload['url']}")
+        return {"url": payload["url"], "scraped_text": scraped_text}
+
+    def run_extract(self, payload):
+        model_name = payload.get("model_name") or pipeline.DEFAULT_MODEL
+        return {"extracted_data": pipeline.extract_notes(payload["scraped_text"], model_name=model_name, cache=self.cache)}
+
+    def run_generate(self, payload):
+        return pipeline.generate_description(
+            payload["extracted_data"], payload["brand"], payload["model"], cache=self.cache, **self._settings(payload)
+        )
+
+    def run_pipeline(self, payload):
+        sites = payload.get("sites") or pipeline.DEFAULT_SITES
+        return pipeline.run_pipeline(
+            payload["brand"], payload["model"], sites, self.api_key, self.engine_id,
+            cache=self.cache, allowed_sites=self.allowed_sites, **self._settings(payload)
+        )
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON request handler; the PerfumeService instance is read from self.server.service
+    and the shared secret from self.server.token.
+    """
+
+    # Socket timeout, so a slow client can't hold a handler thread open indefinitely
+    timeout = 30
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer ") and hmac.compare_digest(auth[len("Bearer "):].encode(), self.server.token.encode()):
+            return True
+        self._send_json(401, {"error": "Missing or invalid token"}, headers={"WWW-Authenticate": "Bearer"})
+        return False
+
+    def _read_payload(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            raise ValueError("Invalid Content-Length")
+        if not 0 <= length <= MAX_BODY_BYTES:
+            raise ValueError(f"Content-Length must be between 0 and {MAX_BODY_BYTES}")
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        return payload
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        if path == "/health":
+            self._send_json(200, {"status": "ok", "instance": service.jobs.instance_id})
+            return
+        if not self._authorized():
+            return
+
+        if path == "/stats":
+            body = {"status": "ok", "jobs": service.jobs.stats(), "cache": service.cache.stats()}
+            if service.draft_cache is not None:
+                body["draft_cache"] = service.draft_cache.stats()
+            self._send_json(200, body)
+        elif path.startswith("/jobs/"):
+            job_id = path[len("/jobs/"):]
+            job = service.jobs.get(job_id)
+            owner = service.jobs.owner(job_id)
+            if job is not None:
+                self._send_json(200, job)
+            elif owner and owner != service.jobs.instance_id:
+                self._send_json(404, {"error": "Job belongs to another instance", "instance": owner})
+            else:
+                self._send_json(404, {"error": "Unknown job id"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        service = self.server.service
+        step = self.path.split("?", 1)[0].strip("/")
+        if step not in PerfumeService.REQUIRED_FIELDS:
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            job_id = service.submit(step, self._read_payload())
+        except QueueFull:
+            self._send_json(429, {"error": "Job queue is full, retry later"}, headers={"Retry-After": "5"})
+            return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        instance_id = service.jobs.instance_id
+        self._send_json(
+            202,
+            {"job_id": job_id, "instance": instance_id, "status_url": f"/jobs/{job_id}"},
+            headers={"X-Instance-Id": instance_id}
+        )
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP service for the perfume description pipeline.")
+    parser.add_argument("--host", default=os.environ.get("SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SERVICE_PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SERVICE_WORKERS", 4)))
+    parser.add_argument("--queue-size", type=int, default=int(os.environ.get("SERVICE_QUEUE_SIZE", 32)))
+    parser.add_argument("--max-jobs", type=int, default=int(os.environ.get("SERVICE_MAX_JOBS", 1000)))
+    parser.add_argument("--instance-id", default=os.environ.get("SERVICE_INSTANCE_ID", socket.gethostname()))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if not INSTANCE_ID_PATTERN.fullmatch(args.instance_id):
+        parser.error("Instance id may only contain letters, digits, '.', '_' and '-'")
+
+    try:
+        token = os.environ["SERVICE_TOKEN"]
+        api_key = os.environ["GOOGLE_API_KEY"]
+        engine_id = os.environ["SEARCH_ENGINE_ID"]
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+    except KeyError as e:
+        parser.error(f"Missing environment variable {e}")
+
+    allowed_sites = pipeline.SITE_OPTIONS
+    if os.environ.get("SERVICE_ALLOWED_SITES"):
+        allowed_sites = [site.strip().lower() for site in os.environ["SERVICE_ALLOWED_SITES"].split(",") if site.strip()]
+
+    cache = ByteBudgetCache(
+        max_bytes=int(float(os.environ.get("CACHE_MAX_MB", 64)) * 1024 * 1024),
+        codec=os.environ.get("CACHE_CODEC", "zlib")
+    )
+    jobs = JobQueue(workers=args.workers, max_queue=args.queue_size, max_jobs=args.max_jobs, instance_id=args.instance_id)
+    draft_cache = SimilarDraftCache(threshold=float(os.environ.get("DRAFT_REUSE_THRESHOLD", 0.8)))
+
+    server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.token = token
+    server.service = PerfumeService(api_key, engine_id, cache, jobs, draft_cache=draft_cache, allowed_sites=allowed_sites)
+    logger.info("Serving on %s:%s as instance %s with %s workers (queue size %s)",
+                args.host, args.port, args.instance_id, args.workers, args.queue_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
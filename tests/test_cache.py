@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from cache import ByteBudgetCache, cached_call
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = ByteBudgetCache(max_bytes=2000)
+    for key in ("a", "b", "c"):
+        assert cache.set(key, os.urandom(500))
+    cache.get("a")  # "b" is now the least recently used
+
+    cache.set("d", os.urandom(500))
+
+    assert "b" not in cache
+    assert all(key in cache for key in ("a", "c", "d"))
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 2000
+
+
+def test_large_value_evicts_several_small_ones():
+    cache = ByteBudgetCache(max_bytes=2000)
+    for key in ("a", "b", "c"):
+        cache.set(key, os.urandom(400))
+
+    cache.set("big", os.urandom(1200))
+
+    assert "big" in cache
+    assert cache.stats()["evictions"] >= 2
+
+
+def test_rejects_value_larger_than_budget():
+    cache = ByteBudgetCache(max_bytes=100)
+
+    assert cache.set("x", os.urandom(500)) is False
+    assert "x" not in cache
+    assert cache.stats()["rejected"] == 1
+    assert cache.stats()["bytes"] == 0
+
+
+def test_keys_count_against_budget():
+    cache = ByteBudgetCache(max_bytes=50_000)
+    for i in range(100):
+        cache.set(("gemini", "x" * 20_000 + str(i)), "ok")
+
+    assert cache.stats()["bytes"] <= 50_000
+    assert len(cache) <= 2
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = ByteBudgetCache()
+    cache.set("k", "value", ttl=10)
+
+    now[0] += 5
+    assert cache.get("k") == "value"
+    now[0] += 6
+    assert cache.get("k") is None
+    assert "k" not in cache
+    assert cache.stats()["bytes"] == 0
+
+
+def test_compression_ratio():
+    cache = ByteBudgetCache()
+    cache.set("text", "tonka bean " * 2000)
+
+    stats = cache.stats()
+    assert stats["compression_ratio"] == pytest.approx(stats["raw_bytes"] / stats["bytes"])
+    assert stats["compression_ratio"] > 10
+
+
+def test_cached_call_skips_values_rejected_by_should_cache():
+    cache = ByteBudgetCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return None
+
+    assert cached_call(cache, "k", compute) is None
+    assert cached_call(cache, "k", compute) is None
+    assert len(calls) == 2
+    assert cached_call(cache, "v", lambda: 5) == 5
+    assert cached_call(cache, "v", lambda: 6) == 5
@@ -0,0 +1,107 @@
+from draft_cache import SimilarDraftCache, adapt_draft, jaccard, notes_tokens
+
+SETTINGS = ("ערב ומסתורי", "יוניסקס", 150, "models/gemini-2.5-flash")
+
+NAXOS = {
+    "perfume_name": "Naxos",
+    "brand_name": "Xerjoff",
+    "top_notes": ["Lavender", "Bergamot", "Lemon"],
+    "heart_notes": ["Honey", "Cinnamon", "Jasmine"],
+    "base_notes": ["Tobacco", "Vanilla", "Tonka Bean"],
+}
+DRAFT = "Naxos by Xerjoff opens with honey and tobacco."
+
+
+def flanker(**changes):
+    return dict(NAXOS, **changes)
+
+
+def test_notes_tokens_normalize_case_and_punctuation():
+    tokens = notes_tokens({"top_notes": [" Tonka  Bean. "], "base_notes": ["Oud"], "heart_notes": None})
+    assert tokens == {"top_notes:tonka bean", "base_notes:oud"}
+
+
+def test_notes_tokens_split_string_tiers_and_ignore_other_types():
+    tokens = notes_tokens({"top_notes": "Bergamot, Lemon", "heart_notes": {"rose": 1}, "base_notes": 7})
+    assert tokens == {"top_notes:bergamot", "top_notes:lemon"}
+
+
+def test_string_tiers_do_not_match_unrelated_perfume_by_characters():
+    cache = SimilarDraftCache(threshold=0.4)
+    cache.add({"top_notes": "bergamot, lemon", "base_notes": "vanilla, tonka"}, SETTINGS, DRAFT, "Naxos", "Xerjoff")
+    other = {"top_notes": "orange blossom, neroli", "base_notes": "amber, musk"}
+
+    assert cache.lookup(other, SETTINGS, "Naxos", "Xerjoff") is None
+
+
+def test_lookup_finds_one_note_swapped_flanker():
+    cache = SimilarDraftCache(threshold=0.8)
+    cache.add(NAXOS, SETTINGS, DRAFT, "Naxos", "Xerjoff")
+    extrait = flanker(perfume_name="Naxos Extrait", base_notes=["Tobacco", "Vanilla", "Benzoin"])
+    assert jaccard(notes_tokens(NAXOS), notes_tokens(extrait)) >= 0.8
+
+    match = cache.lookup(extrait, SETTINGS, "Naxos Extrait", "Xerjoff")
+
+    assert match is not None
+    draft, cached_name, similarity = match
+    assert draft == "Naxos Extrait by Xerjoff opens with honey and tobacco."
+    assert cached_name == "Naxos"
+    assert similarity >= 0.8
+    assert cache.stats()["hits"] == 1
+
+
+def test_settings_mismatch_is_a_miss():
+    cache = SimilarDraftCache()
+    cache.add(NAXOS, SETTINGS, DRAFT, "Naxos", "Xerjoff")
+
+    assert cache.lookup(NAXOS, SETTINGS[:2] + (200,) + SETTINGS[3:], "Naxos", "Xerjoff") is None
+    assert cache.lookup(NAXOS, SETTINGS[:3] + ("models/gemini-2.5-pro",), "Naxos", "Xerjoff") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_unrelated_notes_are_a_miss():
+    cache = SimilarDraftCache()
+    cache.add(NAXOS, SETTINGS, DRAFT, "Naxos", "Xerjoff")
+    other = {"top_notes": ["Saffron"], "heart_notes": ["Rose"], "base_notes": ["Oud"]}
+
+    assert cache.lookup(other, SETTINGS, "Oud Rose", "Other") is None
+
+
+def test_empty_notes_count_as_miss():
+    cache = SimilarDraftCache()
+
+    assert cache.lookup({"top_notes": []}, SETTINGS, "Naxos", "Xerjoff") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_unadaptable_draft_is_a_miss():
+    cache = SimilarDraftCache()
+    cache.add(NAXOS, SETTINGS, "נקסוס של קסרג'וף נפתח בדבש.", "Naxos", "Xerjoff")
+
+    assert cache.lookup(NAXOS, SETTINGS, "Naxos Extrait", "Xerjoff") is None
+    assert cache.lookup(NAXOS, SETTINGS, "Naxos", "Xerjoff") is not None
+    assert cache.stats() == {"entries": 1, "buckets": 16, "threshold": 0.8, "hits": 1, "misses": 1}
+
+
+def test_adapt_draft_requires_every_changed_name_to_be_present():
+    assert adapt_draft(DRAFT, "Naxos", "Xerjoff", "Naxos", "Xerjoff") == DRAFT
+    assert adapt_draft(DRAFT, "Naxos", "Xerjoff", "Erba Pura", "Xerjoff") == "Erba Pura by Xerjoff opens with honey and tobacco."
+    assert adapt_draft(DRAFT, "Naxos", "Xerjoff", "Naxos", "Sospiro") == "Naxos by Sospiro opens with honey and tobacco."
+    assert adapt_draft("A honey and tobacco scent.", "Naxos", "Xerjoff", "Erba Pura", "Xerjoff") is None
+    assert adapt_draft(DRAFT, "", "Xerjoff", "Erba Pura", "Xerjoff") is None
+
+
+def test_lru_eviction_clears_buckets():
+    cache = SimilarDraftCache(max_entries=2)
+    pyramids = [
+        {"top_notes": [f"note {i}a", f"note {i}b"], "base_notes": [f"note {i}c"]}
+        for i in range(3)
+    ]
+    for i, pyramid in enumerate(pyramids):
+        cache.add(pyramid, SETTINGS, f"Perfume {i}", f"Perfume {i}", "Brand")
+
+    assert len(cache) == 2
+    assert cache.stats()["buckets"] <= 2 * cache.bands
+    assert cache.lookup(pyramids[0], SETTINGS, "Perfume 0", "Brand") is None
+    assert cache.lookup(pyramids[2], SETTINGS, "Perfume 2", "Brand") is not None
+    assert all(entry_id in cache._entries for bucket in cache._buckets.values() for entry_id in bucket)
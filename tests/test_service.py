@@ -0,0 +1,241 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import pipeline
+import service
+from cache import ByteBudgetCache
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def make_service(jobs=None):
+    jobs = jobs or service.JobQueue(workers=0, max_queue=4, max_jobs=10)
+    return service.PerfumeService("key", "cx", ByteBudgetCache(), jobs)
+
+
+# --- JobQueue ---
+
+def test_full_queue_raises_queue_full():
+    release = threading.Event()
+    jobs = service.JobQueue(workers=1, max_queue=1, max_jobs=4)
+    running = jobs.submit("scrape", lambda payload: release.wait(), {})
+    assert wait_for(lambda: jobs.get(running)["status"] == "running")
+
+    jobs.submit("scrape", lambda payload: None, {})
+    with pytest.raises(service.QueueFull):
+        jobs.submit("scrape", lambda payload: None, {})
+    assert jobs.stats()["jobs_held"] == 2
+
+    release.set()
+    assert wait_for(lambda: jobs.get(running)["status"] == "done")
+
+
+def test_prune_drops_expired_and_oldest_finished_but_keeps_active_jobs():
+    jobs = service.JobQueue(workers=0, max_queue=2, max_jobs=3, result_ttl=60)
+    now = time.time()
+    for job_id, status, finished in [
+        ("expired", "done", now - 120),
+        ("queued", "queued", None),
+        ("running", "running", None),
+        ("old", "done", now - 30),
+        ("older-failed", "failed", now - 20),
+        ("newest", "done", now - 10),
+    ]:
+        jobs._jobs[job_id] = {"id": job_id, "status": status, "finished": finished}
+
+    jobs._prune()
+
+    assert list(jobs._jobs) == ["queued", "running", "newest"]
+
+
+def test_prune_never_drops_unfinished_jobs_over_cap():
+    jobs = service.JobQueue(workers=0, max_queue=1, max_jobs=1)
+    for job_id in ("a", "b", "c"):
+        jobs._jobs[job_id] = {"id": job_id, "status": "queued", "finished": None}
+
+    jobs._prune()
+
+    assert list(jobs._jobs) == ["a", "b", "c"]
+
+
+def test_owner_handles_instance_ids_with_dashes():
+    jobs = service.JobQueue(workers=0, max_queue=1, max_jobs=1, instance_id="web-eu-1")
+    job_id = jobs.submit("scrape", lambda payload: None, {})
+
+    assert job_id.startswith("web-eu-1-")
+    assert jobs.owner(job_id) == "web-eu-1"
+    assert jobs.owner("nodash") is None
+
+
+# --- PerfumeService.validate ---
+
+@pytest.mark.parametrize("step, payload, message", [
+    ("pipeline", {"brand": "Xerjoff", "model": "Naxos", "length": True}, "length"),
+    ("pipeline", {"brand": "Xerjoff", "model": "Naxos", "length": 5}, "length"),
+    ("pipeline", {"brand": "Xerjoff", "model": "Naxos", "sites": "fragrantica.com"}, "sites"),
+    ("search", {"brand": "Xerjoff", "model": "Naxos", "sites": ["evil.com"]}, "not allowed"),
+    ("scrape", {"url": "https://fragrantica.com.evil.com/naxos"}, "url"),
+    ("scrape", {"url": "http://169.254.169.254/latest/meta-data"}, "url"),
+    ("scrape", {"url": "file:///etc/passwd"}, "url"),
+    ("generate", {"extracted_data": {"top_notes": "bergamot, lemon"}, "brand": "Xerjoff", "model": "Naxos"}, "top_notes"),
+    ("generate", {"extracted_data": ["bergamot"], "brand": "Xerjoff", "model": "Naxos"}, "extracted_data"),
+    ("extract", {"scraped_text": 42}, "scraped_text"),
+])
+def test_validate_rejects_bad_payloads(step, payload, message):
+    with pytest.raises(ValueError, match=message):
+        make_service().validate(step, payload)
+
+
+def test_validate_accepts_allowed_subdomain():
+    make_service().validate("scrape", {"url": "https://www.fragrantica.com/perfume/Xerjoff/Naxos"})
+    make_service().validate("pipeline", {"brand": "Xerjoff", "model": "Naxos", "sites": ["fragrantica.com"], "length": 150})
+
+
+# --- HTTP layer ---
+
+@pytest.fixture
+def server():
+    httpd = service.ThreadingHTTPServer(("127.0.0.1", 0), service.RequestHandler)
+    httpd.token = "s3cret"
+    httpd.service = make_service(service.JobQueue(workers=0, max_queue=4, max_jobs=10, instance_id="node-a"))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def request(server, method, path, body=None, token=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_health_does_not_require_token(server):
+    status, body = request(server, "GET", "/health")
+
+    assert status == 200
+    assert body == {"status": "ok", "instance": "node-a"}
+
+
+@pytest.mark.parametrize("method, path", [("GET", "/stats"), ("GET", "/jobs/node-a-abc"), ("POST", "/extract")])
+def test_missing_or_wrong_token_is_rejected(server, method, path):
+    body = {"scraped_text": "x"} if method == "POST" else None
+    assert request(server, method, path, body)[0] == 401
+    assert request(server, method, path, body, token="wrong")[0] == 401
+
+
+def test_valid_token_is_accepted(server):
+    status, body = request(server, "POST", "/extract", {"scraped_text": "x"}, token="s3cret")
+
+    assert status == 202
+    assert body["instance"] == "node-a"
+    assert request(server, "GET", "/stats", token="s3cret")[0] == 200
+    assert request(server, "GET", body["status_url"], token="s3cret")[1]["status"] == "queued"
+
+
+def test_handler_has_socket_timeout():
+    assert service.RequestHandler.timeout
+
+
+# --- Scrape URL checks ---
+
+class FakeResponse:
+    def __init__(self, status_code=200, location=None, text="<p>Naxos</p>"):
+        self.status_code = status_code
+        self.headers = {"Location": location} if location else {}
+        self.text = text
+
+    @property
+    def is_redirect(self):
+        return self.status_code in (301, 302, 303, 307, 308)
+
+    def raise_for_status(self):
+        pass
+
+
+class RecordingUI:
+    def __init__(self):
+        self.errors = []
+
+    def info(self, msg):
+        pass
+
+    success = warning = info
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+
+def fake_getaddrinfo(addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (addresses[host], port))]
+    return getaddrinfo
+
+
+def test_url_matches_sites_rejects_lookalike_hosts():
+    sites = ["fragrantica.com"]
+    assert pipeline.url_matches_sites("https://www.fragrantica.com/x", sites)
+    assert not pipeline.url_matches_sites("https://fragrantica.com.evil.com/x", sites)
+    assert not pipeline.url_matches_sites("https://evilfragrantica.com/x", sites)
+    assert not pipeline.url_matches_sites("ftp://fragrantica.com/x", sites)
+
+
+def test_redirect_to_private_host_is_blocked(monkeypatch):
+    monkeypatch.setattr(pipeline.socket, "getaddrinfo", fake_getaddrinfo({
+        "www.fragrantica.com": "151.101.1.69",
+        "internal.fragrantica.com": "127.0.0.1",
+    }))
+    fetched = []
+
+    def fake_get(url, **kwargs):
+        fetched.append(url)
+        assert kwargs["allow_redirects"] is False
+        return FakeResponse(302, location="http://internal.fragrantica.com/admin")
+
+    monkeypatch.setattr(pipeline.requests, "get", fake_get)
+    ui = RecordingUI()
+
+    assert pipeline._scrape_page_text("https://www.fragrantica.com/naxos", allowed_sites=["fragrantica.com"], ui=ui) is None
+    assert fetched == ["https://www.fragrantica.com/naxos"]
+    assert "non-public" in ui.errors[0]
+
+
+def test_redirect_off_allowed_sites_is_blocked(monkeypatch):
+    monkeypatch.setattr(pipeline.socket, "getaddrinfo", fake_getaddrinfo({"www.fragrantica.com": "151.101.1.69"}))
+    fetched = []
+
+    def fake_get(url, **kwargs):
+        fetched.append(url)
+        return FakeResponse(302, location="http://169.254.169.254/latest/meta-data")
+
+    monkeypatch.setattr(pipeline.requests, "get", fake_get)
+    ui = RecordingUI()
+
+    assert pipeline._scrape_page_text("https://www.fragrantica.com/naxos", allowed_sites=["fragrantica.com"], ui=ui) is None
+    assert fetched == ["https://www.fragrantica.com/naxos"]
+    assert "not on an allowed site" in ui.errors[0]
+
+
+def test_allowed_redirect_is_followed(monkeypatch):
+    monkeypatch.setattr(pipeline.socket, "getaddrinfo", fake_getaddrinfo({
+        "fragrantica.com": "151.101.1.69",
+        "www.fragrantica.com": "151.101.1.69",
+    }))
+    responses = iter([FakeResponse(301, location="https://www.fragrantica.com/naxos"), FakeResponse(200)])
+    monkeypatch.setattr(pipeline.requests, "get", lambda url, **kwargs: next(responses))
+
+    assert pipeline._scrape_page_text("http://fragrantica.com/naxos", allowed_sites=["fragrantica.com"]) == "Naxos"